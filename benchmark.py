@@ -0,0 +1,91 @@
+#!/usr/bin/python
+"""
+    Benchmark the in-process TodoList API against running todo.py in a
+    subprocess for each action, as a script calling the CLI would.
+
+    usage: benchmark.py [TASKS] [REPEATS]
+"""
+
+import sys
+import os
+import shutil
+import subprocess
+import tempfile
+import timeit
+
+from todo import TodoList
+
+
+def make_todo_dir( base_dir, size ):
+    "Create a todo directory holding size tasks, with a cfg file to use it"
+    todo_dir = os.path.join( base_dir, "todo" )
+    os.makedirs( todo_dir )
+
+    with open( os.path.join( todo_dir, "todo.txt" ), "w" ) as fh:
+        for number in range( size ):
+            fh.write( "2015-01-01 Task number %d +project%d @context%d\n" % (
+                number, number % 10, number % 7 )
+                )
+        fh.close()
+
+    # todo.py looks for its cfg file next to the script
+    script = os.path.join( base_dir, "todo.py" )
+    shutil.copyfile(
+            os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                "todo.py" ),
+            script
+            )
+    with open( os.path.join( base_dir, "todo.cfg" ), "w" ) as fh:
+        fh.write( "[default]\ntodo_dir: %s\ncolour_mode = false\n" % todo_dir )
+        fh.close()
+
+    return ( todo_dir, script )
+
+def main( size, repeats ):
+    base_dir = tempfile.mkdtemp()
+    try:
+        todo_dir, script = make_todo_dir( base_dir, size )
+        devnull = open( os.devnull, "w" )
+
+        def run( *action ):
+            subprocess.check_call(
+                    [ sys.executable, script, "-p" ] + list( action ),
+                    stdout=devnull
+                    )
+
+        def api_add():
+            todo_list = TodoList.load( todo_dir )
+            todo_list.add( "Benchmark task +bench", force=True )
+            todo_list.save()
+
+        benchmarks = [
+            ( "ls +project1",
+                lambda: TodoList.load( todo_dir ).query( [ "+project1" ] ),
+                lambda: run( "ls", "+project1" ) ),
+            ( "add --force",
+                api_add,
+                lambda: run( "add", "--force", "Benchmark task +bench" ) ),
+            ]
+
+        print "%d tasks, best of %d runs" % ( size, repeats )
+        print "%-15s %12s %12s" % ( "action", "in-process", "subprocess" )
+        for ( name, api, cli ) in benchmarks:
+            api_time = min( timeit.repeat( api, number=1, repeat=repeats ) )
+            cli_time = min( timeit.repeat( cli, number=1, repeat=repeats ) )
+            print "%-15s %10.2fms %10.2fms" % (
+                    name, api_time * 1000, cli_time * 1000 )
+
+        devnull.close()
+    finally:
+        shutil.rmtree( base_dir )
+
+
+if __name__ == "__main__":
+    size = 1000
+    repeats = 20
+    if len( sys.argv ) > 1:
+        size = int( sys.argv[1] )
+    if len( sys.argv ) > 2:
+        repeats = int( sys.argv[2] )
+
+    main( size, repeats )
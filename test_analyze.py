@@ -0,0 +1,201 @@
+#!/usr/bin/python
+"""
+    Tests for the DoneSnapshot behind the analyze action. Every test runs
+    with numpy turned off, and again with numpy if it is installed, and
+    both must give the same results.
+
+    usage: python -m unittest test_analyze
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import date
+
+import todo
+from todo import DoneSnapshot
+
+
+DONE_LINES = [
+    "x 2026-01-05 (A) 2026-01-01 write report +work @office",
+    "x 2026-01-20 2026-01-02 (B) call mum +family @phone",
+    "x 2026-02-03 buy milk @shop",
+    "x 2026-02-04 2026-01-30 fix bike +home +bike",
+    "garbage line",
+    "x 2026-13-40 bad date",
+    ]
+
+APPENDED_LINES = [
+    "x 2026-02-10 2026-02-01 write report +work @office",
+    "x 2026-03-02 (C) 2026-02-02 water plants +home",
+    ]
+
+
+def results( snapshot ):
+    "Everything the analyze action can ask a snapshot for"
+    analysis = {
+        "rows":         len( snapshot ),
+        "lead_times":   snapshot.lead_times(),
+        }
+    for period in [ "week", "month" ]:
+        analysis[ period ] = snapshot.completions( period )
+    for group in [ "project", "context", "priority" ]:
+        for period in [ None, "week", "month" ]:
+            analysis[ ( group, period ) ] = snapshot.counts( group, period )
+    return analysis
+
+
+class SnapshotTest( unittest.TestCase ):
+    "Runs the snapshot tests without numpy"
+
+    use_numpy = False
+
+    def setUp( self ):
+        self.numpy = todo.numpy
+        if not self.use_numpy:
+            todo.numpy = None
+
+        self.todo_dir = tempfile.mkdtemp()
+        self.done_file = os.path.join( self.todo_dir, "done.txt" )
+        self.write( DONE_LINES )
+
+    def tearDown( self ):
+        todo.numpy = self.numpy
+        shutil.rmtree( self.todo_dir )
+
+    def write( self, lines, mode="w" ):
+        with open( self.done_file, mode ) as fh:
+            for line in lines:
+                fh.write( "%s\n" % line )
+            fh.close()
+
+    def fresh_results( self ):
+        "Results from a snapshot built from scratch"
+        snapshot = DoneSnapshot( self.done_file )
+        snapshot.update()
+        return results( snapshot )
+
+    def test_counts( self ):
+        snapshot = DoneSnapshot.load( self.done_file )
+
+        # The lines without a valid completion date are skipped
+        self.assertEqual( len( snapshot ), 4 )
+
+        self.assertEqual( snapshot.counts( "project" ), {
+            ( "work", None ): 1, ( "family", None ): 1,
+            ( "home", None ): 1, ( "bike", None ): 1 } )
+        self.assertEqual( snapshot.counts( "priority" ), {
+            ( "none", None ): 2, ( "A", None ): 1, ( "B", None ): 1 } )
+        self.assertEqual( snapshot.counts( "context", "month" ), {
+            ( "office", date( 2026, 1, 1 ) ): 1,
+            ( "phone", date( 2026, 1, 1 ) ): 1,
+            ( "shop", date( 2026, 2, 1 ) ): 1 } )
+        self.assertEqual( snapshot.counts( "project", "week" ), {
+            ( "work", date( 2026, 1, 5 ) ): 1,
+            ( "family", date( 2026, 1, 19 ) ): 1,
+            ( "home", date( 2026, 2, 2 ) ): 1,
+            ( "bike", date( 2026, 2, 2 ) ): 1 } )
+
+    def test_completions( self ):
+        snapshot = DoneSnapshot.load( self.done_file )
+
+        self.assertEqual( snapshot.completions( "week" ), [
+            ( date( 2026, 1, 5 ), 1 ), ( date( 2026, 1, 12 ), 0 ),
+            ( date( 2026, 1, 19 ), 1 ), ( date( 2026, 1, 26 ), 0 ),
+            ( date( 2026, 2, 2 ), 2 ) ] )
+        self.assertEqual( snapshot.completions( "month" ), [
+            ( date( 2026, 1, 1 ), 2 ), ( date( 2026, 2, 1 ), 2 ) ] )
+
+    def test_lead_times( self ):
+        snapshot = DoneSnapshot.load( self.done_file )
+
+        self.assertEqual( snapshot.lead_times(),
+                { "tasks": 3, "mean": 9.0, "median": 5, "max": 18 } )
+
+    def test_empty( self ):
+        self.write( [] )
+        snapshot = DoneSnapshot.load( self.done_file )
+
+        self.assertEqual( snapshot.completions( "week" ), [] )
+        self.assertEqual( snapshot.counts( "project", "month" ), {} )
+        self.assertEqual( snapshot.lead_times()[ "tasks" ], 0 )
+
+    def test_incremental_append( self ):
+        snapshot = DoneSnapshot.load( self.done_file )
+        self.assertTrue( os.path.exists( snapshot.snapshot_file ) )
+
+        self.write( APPENDED_LINES, "a" )
+        snapshot = DoneSnapshot.load( self.done_file )
+
+        self.assertEqual( len( snapshot ), 6 )
+        self.assertEqual( snapshot.size, os.path.getsize( self.done_file ) )
+        self.assertEqual( results( snapshot ), self.fresh_results() )
+
+        # Loading again with nothing appended leaves it unchanged
+        self.assertFalse( DoneSnapshot.load( self.done_file ).update() )
+
+    def test_partly_written_line( self ):
+        DoneSnapshot.load( self.done_file )
+
+        with open( self.done_file, "a" ) as fh:
+            fh.write( APPENDED_LINES[0] )
+            fh.close()
+        self.assertEqual( len( DoneSnapshot.load( self.done_file ) ), 4 )
+
+        with open( self.done_file, "a" ) as fh:
+            fh.write( "\n" )
+            fh.close()
+        self.assertEqual( len( DoneSnapshot.load( self.done_file ) ), 5 )
+
+    def test_shrunk_done_file( self ):
+        self.write( DONE_LINES + APPENDED_LINES )
+        DoneSnapshot.load( self.done_file )
+
+        # As left by restoring an earlier backup generation
+        self.write( DONE_LINES[:2] )
+        snapshot = DoneSnapshot.load( self.done_file )
+
+        self.assertEqual( len( snapshot ), 2 )
+        self.assertEqual( results( snapshot ), self.fresh_results() )
+
+    def test_rewritten_done_file( self ):
+        DoneSnapshot.load( self.done_file )
+
+        # Same size, different tasks
+        self.write( [ line.replace( "+work", "+play" ) for line in DONE_LINES ] )
+        snapshot = DoneSnapshot.load( self.done_file )
+
+        self.assertEqual( snapshot.counts( "project" )[ ( "play", None ) ], 1 )
+        self.assertFalse( ( "work", None ) in snapshot.counts( "project" ) )
+        self.assertEqual( results( snapshot ), self.fresh_results() )
+
+    def test_unreadable_snapshot_is_rebuilt( self ):
+        snapshot = DoneSnapshot.load( self.done_file )
+        with open( snapshot.snapshot_file, "wb" ) as fh:
+            fh.write( "TODOCOL1 truncated" )
+            fh.close()
+
+        self.assertEqual( results( DoneSnapshot.load( self.done_file ) ),
+                self.fresh_results() )
+
+
+@unittest.skipIf( todo.numpy is None, "numpy is not installed" )
+class NumpySnapshotTest( SnapshotTest ):
+    "Runs the snapshot tests with numpy"
+
+    use_numpy = True
+
+    def test_same_as_without_numpy( self ):
+        self.write( APPENDED_LINES, "a" )
+        with_numpy = results( DoneSnapshot.load( self.done_file ) )
+
+        todo.numpy = None
+        without_numpy = results( DoneSnapshot.load( self.done_file ) )
+
+        self.assertEqual( with_numpy, without_numpy )
+
+
+if __name__ == "__main__":
+    unittest.main()
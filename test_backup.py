@@ -0,0 +1,143 @@
+#!/usr/bin/python
+"""
+    Tests for the backup generations kept by TodoList.save and rolled back
+    by TodoList.restore.
+
+    usage: python -m unittest test_backup
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from todo import TodoList
+
+
+class BackupTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.todo_dir = tempfile.mkdtemp()
+        self.backup_dir = os.path.join( self.todo_dir, "backup" )
+
+    def tearDown( self ):
+        shutil.rmtree( self.todo_dir )
+
+    def load( self, name="todo", backups=10 ):
+        return TodoList.load( self.todo_dir, name, backups )
+
+    def read( self, filename ):
+        filename = os.path.join( self.todo_dir, filename )
+        if not os.path.exists( filename ):
+            return ""
+        with open( filename, "rb" ) as fh:
+            content = fh.read()
+            fh.close()
+        return content
+
+    def add( self, text, name="todo", backups=10 ):
+        todo_list = self.load( name, backups )
+        todo_list.add( text )
+        todo_list.save()
+
+    def add_and_archive( self, text ):
+        "Add, complete and archive a task, saving after each as todo.py does"
+        self.add( text )
+
+        todo_list = self.load()
+        todo_list.complete( len( todo_list ) )
+        todo_list.save()
+
+        todo_list = self.load()
+        todo_list.archive()
+        todo_list.save()
+
+    def restore( self, number ):
+        "Restore generation number, counted newest first from 1"
+        todo_list = self.load()
+        todo_list.restore( todo_list.generations()[ number - 1 ] )
+        return todo_list
+
+    def test_save_keeps_generations_per_list( self ):
+        for text in [ "one", "two" ]:
+            self.add( text, backups=3 )
+        for text in [ "one", "two", "three", "four" ]:
+            self.add( text, "work", backups=3 )
+
+        self.assertEqual( len( self.load().generations() ), 2 )
+        self.assertEqual( len( self.load( "work" ).generations() ), 3 )
+
+    def test_no_backups( self ):
+        self.add( "one", backups=0 )
+
+        self.assertFalse( os.path.exists( self.backup_dir ) )
+        self.assertEqual( self.load().generations(), [] )
+
+    def test_restore_todo_file( self ):
+        self.add( "one" )
+        self.add( "two" )
+
+        todo_list = self.restore( 1 )
+
+        self.assertEqual( [ task.text[11:] for task in todo_list.tasks() ],
+                [ "one" ] )
+
+        # The restored file is a copy, not a link to the backup
+        todo_file = os.path.join( self.todo_dir, "todo.txt" )
+        self.assertEqual( os.stat( todo_file ).st_nlink, 1 )
+
+    def test_restore_done_file( self ):
+        self.add_and_archive( "one" )
+        self.assertTrue( self.read( "done.txt" ) )
+
+        todo_list = self.restore( 1 )
+
+        self.assertEqual( self.read( "done.txt" ), "" )
+        self.assertEqual( len( todo_list ), 1 )
+        self.assertTrue( todo_list.task( 1 ).done )
+
+    def test_restore_is_undone_by_restoring_it( self ):
+        self.add_and_archive( "one" )
+        self.add( "two" )
+        todo_file = self.read( "todo.txt" )
+        done_file = self.read( "done.txt" )
+
+        self.restore( 2 )
+        self.assertEqual( self.read( "done.txt" ), "" )
+
+        self.restore( 1 )
+        self.assertEqual( self.read( "todo.txt" ), todo_file )
+        self.assertEqual( self.read( "done.txt" ), done_file )
+
+    def test_restore_back_then_forward( self ):
+        self.add_and_archive( "one" )
+        after_one = self.read( "done.txt" )
+        self.add_and_archive( "two" )
+        after_two = self.read( "done.txt" )
+
+        # To before the first archive, then to before the second "do",
+        # which is generation 3 once the first restore has added one.
+        self.restore( 4 )
+        self.assertEqual( self.read( "done.txt" ), "" )
+
+        self.restore( 3 )
+        self.assertEqual( self.read( "done.txt" ), after_one )
+        self.assertFalse( "\0" in self.read( "done.txt" ) )
+
+        # Undo the second restore, then the first
+        self.restore( 1 )
+        self.assertEqual( self.read( "done.txt" ), "" )
+        self.restore( 3 )
+        self.assertEqual( self.read( "done.txt" ), after_two )
+
+    def test_stray_backup_entries_are_ignored( self ):
+        self.add( "one" )
+        os.mkdir( os.path.join( self.backup_dir, "notes" ) )
+        open( os.path.join( self.backup_dir, "README.txt" ), "w" ).close()
+
+        self.assertEqual( len( self.load().generations() ), 1 )
+        self.assertEqual( len( self.restore( 1 ) ), 0 )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+"""
+    Tests for TodoList.sync, using a temporary directory as the remote.
+
+    usage: python -m unittest test_sync
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from todo import TodoList
+
+
+class SyncTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.base_dir = tempfile.mkdtemp()
+        self.local_dir = os.path.join( self.base_dir, "local" )
+        self.remote_dir = os.path.join( self.base_dir, "remote" )
+        os.mkdir( self.local_dir )
+        os.mkdir( self.remote_dir )
+
+    def tearDown( self ):
+        shutil.rmtree( self.base_dir )
+
+    def write( self, todo_dir, filename, lines, age=0 ):
+        "Write a file, dated age seconds in the past"
+        filename = os.path.join( todo_dir, filename )
+        with open( filename, "w" ) as fh:
+            for line in lines:
+                fh.write( "%s\n" % line )
+            fh.close()
+
+        mtime = time.time() - age
+        os.utime( filename, ( mtime, mtime ) )
+
+    def read( self, todo_dir, filename ):
+        filename = os.path.join( todo_dir, filename )
+        if not os.path.exists( filename ):
+            return []
+        with open( filename ) as fh:
+            lines = [ line.strip() for line in fh ]
+            fh.close()
+        return lines
+
+    def sync( self ):
+        "Sync the local list with the remote one and save both"
+        local = TodoList.load( self.local_dir, backups=0 )
+        remote = TodoList.load( self.remote_dir, backups=0 )
+        changes = local.sync( remote )
+        remote.save()
+        local.save()
+        return changes
+
+    def assertBoth( self, filename, lines ):
+        "Check both copies of filename hold lines, in any order"
+        self.assertEqual( sorted( self.read( self.local_dir, filename ) ),
+                sorted( lines ) )
+        self.assertEqual( sorted( self.read( self.remote_dir, filename ) ),
+                sorted( lines ) )
+
+    def test_first_sync_merges_both_sides( self ):
+        self.write( self.local_dir, "todo.txt", [ "2026-10-01 local task" ] )
+        self.write( self.remote_dir, "todo.txt", [ "2026-10-02 remote task" ] )
+        self.write( self.remote_dir, "done.txt",
+                [ "x 2026-09-01 2026-08-01 old task" ] )
+
+        changes = self.sync()
+
+        self.assertBoth( "todo.txt",
+                [ "2026-10-01 local task", "2026-10-02 remote task" ] )
+        self.assertBoth( "done.txt", [ "x 2026-09-01 2026-08-01 old task" ] )
+        self.assertEqual( changes[ "local_added" ], 1 )
+        self.assertEqual( changes[ "remote_added" ], 1 )
+        self.assertEqual( changes[ "done_pulled" ], 1 )
+
+    def test_recurring_task_in_done_history_is_kept( self ):
+        self.write( self.local_dir, "todo.txt", [ "pay rent +home" ] )
+        self.write( self.remote_dir, "todo.txt",
+                [ "2026-10-01 pay rent +home" ], age=60 )
+        self.write( self.remote_dir, "done.txt",
+                [ "x 2026-09-01 2026-08-01 pay rent +home" ] )
+
+        self.sync()
+
+        # Both are the same task, so one of them is kept
+        self.assertBoth( "todo.txt", [ "pay rent +home" ] )
+        self.assertBoth( "done.txt",
+                [ "x 2026-09-01 2026-08-01 pay rent +home" ] )
+
+        # Archiving it and adding next month's is kept on both sides
+        self.write( self.remote_dir, "done.txt",
+                [ "x 2026-09-01 2026-08-01 pay rent +home",
+                  "x 2026-10-05 pay rent +home" ] )
+        self.write( self.remote_dir, "todo.txt",
+                [ "2026-11-01 pay rent +home" ] )
+
+        self.sync()
+
+        self.assertBoth( "todo.txt", [ "2026-11-01 pay rent +home" ] )
+        self.assertBoth( "done.txt",
+                [ "x 2026-09-01 2026-08-01 pay rent +home",
+                  "x 2026-10-05 pay rent +home" ] )
+
+    def test_deleted_on_one_side_changed_on_the_other( self ):
+        self.write( self.local_dir, "todo.txt",
+                [ "2026-10-01 edit me", "2026-10-01 keep me" ] )
+        self.sync()
+
+        self.write( self.local_dir, "todo.txt", [ "2026-10-01 keep me" ] )
+        self.write( self.remote_dir, "todo.txt",
+                [ "(A) 2026-10-01 edit me", "2026-10-01 keep me" ] )
+
+        self.sync()
+
+        self.assertBoth( "todo.txt",
+                [ "(A) 2026-10-01 edit me", "2026-10-01 keep me" ] )
+
+    def test_done_wins( self ):
+        self.write( self.local_dir, "todo.txt", [ "2026-10-01 task" ] )
+        self.sync()
+
+        self.write( self.local_dir, "todo.txt",
+                [ "x 2026-10-10 2026-10-01 task" ], age=60 )
+        self.write( self.remote_dir, "todo.txt", [ "(A) 2026-10-01 task" ] )
+
+        changes = self.sync()
+
+        self.assertBoth( "todo.txt", [ "x 2026-10-10 2026-10-01 task" ] )
+        self.assertEqual( len( changes[ "conflicts" ] ), 1 )
+
+    def test_archived_wins_over_change( self ):
+        self.write( self.local_dir, "todo.txt", [ "2026-10-01 task" ] )
+        self.sync()
+
+        self.write( self.local_dir, "todo.txt", [] )
+        self.write( self.local_dir, "done.txt",
+                [ "x 2026-10-10 2026-10-01 task" ] )
+        self.write( self.remote_dir, "todo.txt", [ "(A) 2026-10-01 task" ] )
+
+        self.sync()
+
+        self.assertBoth( "todo.txt", [] )
+        self.assertBoth( "done.txt", [ "x 2026-10-10 2026-10-01 task" ] )
+
+    def test_newer_file_wins( self ):
+        self.write( self.local_dir, "todo.txt", [ "2026-10-01 task" ] )
+        self.sync()
+
+        self.write( self.local_dir, "todo.txt",
+                [ "(B) 2026-10-01 task" ], age=60 )
+        self.write( self.remote_dir, "todo.txt", [ "(C) 2026-10-01 task" ] )
+        self.sync()
+        self.assertBoth( "todo.txt", [ "(C) 2026-10-01 task" ] )
+
+        self.write( self.local_dir, "todo.txt", [ "(A) 2026-10-01 task" ] )
+        self.write( self.remote_dir, "todo.txt",
+                [ "(D) 2026-10-01 task" ], age=60 )
+        self.sync()
+        self.assertBoth( "todo.txt", [ "(A) 2026-10-01 task" ] )
+
+    def test_second_sync_makes_no_changes( self ):
+        self.write( self.local_dir, "todo.txt", [ "2026-10-01 one" ] )
+        self.write( self.remote_dir, "todo.txt", [ "2026-10-01 two" ] )
+        self.write( self.local_dir, "done.txt", [ "x 2026-10-02 three" ] )
+        self.sync()
+
+        changes = self.sync()
+
+        for key in [ "local_added", "local_removed", "remote_added",
+                "remote_removed", "done_pulled", "done_pushed" ]:
+            self.assertEqual( changes[ key ], 0, key )
+        self.assertEqual( changes[ "conflicts" ], [] )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+"""
+    Tests for the TodoList and TodoLists classes used by todo.py and by
+    other programs.
+
+    usage: python -m unittest test_todolist
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import date
+
+from todo import DuplicateTaskError, Task, TodoError, TodoList, TodoLists
+
+
+TODAY = date.today().strftime( "%Y-%m-%d" )
+
+
+class TodoListTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.todo_dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.todo_dir )
+
+    def write( self, filename, lines ):
+        with open( os.path.join( self.todo_dir, filename ), "w" ) as fh:
+            for line in lines:
+                fh.write( "%s\n" % line )
+            fh.close()
+
+    def read( self, filename ):
+        with open( os.path.join( self.todo_dir, filename ) ) as fh:
+            lines = [ line.strip() for line in fh ]
+            fh.close()
+        return lines
+
+    def load( self, name="todo" ):
+        return TodoList.load( self.todo_dir, name, backups=0 )
+
+    def test_load_returns_numbered_tasks( self ):
+        self.write( "todo.txt", [ "(A) first", "second" ] )
+        todo_list = self.load()
+
+        self.assertEqual( len( todo_list ), 2 )
+        task = todo_list.task( 2 )
+        self.assertTrue( isinstance( task, Task ) )
+        self.assertEqual( ( task.text, task.number, task.source,
+            task.list_name ), ( "second", 2, "todo.txt", "todo" ) )
+        self.assertEqual( todo_list.task( 1 ).priority, "A" )
+
+        self.assertRaises( TodoError, todo_list.task, 3 )
+
+    def test_add_dates_the_task( self ):
+        todo_list = self.load()
+        task = todo_list.add( "Repair the FTL drive +Galactica" )
+
+        self.assertEqual( task.text,
+                "%s Repair the FTL drive +Galactica" % TODAY )
+        self.assertEqual( task.number, 1 )
+        self.assertEqual( task.projects, [ "Galactica" ] )
+
+    def test_add_rejects_an_open_duplicate( self ):
+        self.write( "todo.txt", [ "first", "(B) 2026-01-01 call mum @phone" ] )
+        todo_list = self.load()
+
+        try:
+            todo_list.add( "(A) call mum @phone" )
+            self.fail( "DuplicateTaskError not raised" )
+        except DuplicateTaskError as err:
+            self.assertEqual( err.task.number, 2 )
+            self.assertEqual( err.task.text, "(B) 2026-01-01 call mum @phone" )
+
+        self.assertEqual( len( todo_list ), 2 )
+
+    def test_add_force_allows_a_duplicate( self ):
+        todo_list = self.load()
+        todo_list.add( "call mum" )
+        task = todo_list.add( "call mum", force=True )
+
+        self.assertEqual( task.number, 2 )
+        self.assertEqual( len( todo_list ), 2 )
+
+    def test_duplicates_ignore_date_priority_and_tag_order( self ):
+        todo_list = self.load()
+        todo_list.add( "fix bike +home @garage" )
+
+        self.assertRaises( DuplicateTaskError,
+                todo_list.add, "(C) fix bike @garage +home" )
+
+        # Done tasks and tasks that differ in case are not duplicates
+        todo_list.add( "Fix Bike +home @garage" )
+        todo_list.complete( 1 )
+        todo_list.add( "fix bike +home @garage" )
+        self.assertEqual( len( todo_list ), 3 )
+
+    def test_merge_keeps_the_open_task_with_the_new_priority( self ):
+        self.write( "todo.txt", [ "2026-01-01 (C) buy milk" ] )
+        todo_list = self.load()
+
+        task = todo_list.merge( 1, "(A) buy milk" )
+
+        self.assertEqual( task.text, "(A) 2026-01-01 buy milk" )
+        self.assertEqual( len( todo_list ), 1 )
+
+    def test_complete_and_archive( self ):
+        self.write( "todo.txt", [ "first", "second" ] )
+        todo_list = self.load()
+
+        task = todo_list.complete( 2 )
+        self.assertTrue( task.done )
+        self.assertEqual( task.text, "x %s second" % TODAY )
+
+        archived = todo_list.archive()
+        self.assertEqual( [ task.text for task in archived ], [ task.text ] )
+        self.assertEqual( archived[0].source, "done.txt" )
+        self.assertRaises( TodoError, todo_list.archive )
+
+        todo_list.save()
+        self.assertEqual( self.read( "todo.txt" ), [ "first" ] )
+        self.assertEqual( self.read( "done.txt" ), [ "x %s second" % TODAY ] )
+
+    def test_query_keeps_line_numbers( self ):
+        self.write( "todo.txt", [ "walk dog @park", "buy milk @shop",
+            "feed dog @home" ] )
+        todo_list = self.load()
+
+        tasks = todo_list.query( [ "dog" ] )
+
+        self.assertEqual( [ ( task.number, task.text ) for task in tasks ],
+                [ ( 3, "feed dog @home" ), ( 1, "walk dog @park" ) ] )
+        self.assertEqual( len( todo_list.query() ), 3 )
+
+    def test_save_sorts_the_lines( self ):
+        todo_list = self.load()
+        zebra = todo_list.add( "zebra" )
+        todo_list.add( "apple" )
+        self.assertEqual( zebra.number, 1 )
+
+        todo_list.save()
+
+        # Numbers from before the save now point at other tasks
+        self.assertEqual( todo_list.task( 1 ).text, "%s apple" % TODAY )
+        self.assertEqual( todo_list.query( [ "zebra" ] )[0].number, 2 )
+        self.assertEqual( self.read( "todo.txt" ),
+                [ "%s apple" % TODAY, "%s zebra" % TODAY ] )
+
+        # The duplicate check uses the new numbers
+        try:
+            todo_list.add( "zebra" )
+            self.fail( "DuplicateTaskError not raised" )
+        except DuplicateTaskError as err:
+            self.assertEqual( err.task.number, 2 )
+
+    def test_dedupe_clusters( self ):
+        self.write( "todo.txt", [ "(A) call mum", "walk dog",
+            "2026-01-01 call mum", "feed cat" ] )
+        self.write( "done.txt", [ "x 2026-01-02 walk dog", "x 2026-01-03 other" ] )
+        todo_list = self.load()
+
+        clusters = todo_list.duplicates()
+        self.assertEqual( [ [ task.number for task in cluster ]
+            for cluster in clusters ], [ [ 1, 3 ] ] )
+
+        clusters = todo_list.duplicates( include_done=True )
+        self.assertEqual( [ [ ( task.source, task.number ) for task in cluster ]
+            for cluster in clusters ],
+            [ [ ( "todo.txt", 1 ), ( "todo.txt", 3 ) ],
+              [ ( "todo.txt", 2 ), ( "done.txt", 1 ) ] ] )
+
+    def test_list_names( self ):
+        self.assertRaises( TodoError, TodoList, self.todo_dir, "done" )
+        self.assertRaises( TodoError, TodoList, self.todo_dir, "work-done" )
+        self.assertRaises( TodoError, TodoList, self.todo_dir, "report" )
+
+        todo_list = self.load( "work" )
+        self.assertEqual( os.path.basename( todo_list.todo_file ), "work.txt" )
+        self.assertEqual( os.path.basename( todo_list.done_file ),
+                "work-done.txt" )
+
+
+class TodoListsTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.todo_dir = tempfile.mkdtemp()
+        self.write( "todo.txt", [ "b home", "d home" ] )
+        self.write( "done.txt", [ "x 2026-01-01 done home" ] )
+        self.write( "work.txt", [ "a work", "c work", "e work" ] )
+        self.write( "report.txt", [ "not a list" ] )
+
+    def tearDown( self ):
+        shutil.rmtree( self.todo_dir )
+
+    def write( self, filename, lines ):
+        with open( os.path.join( self.todo_dir, filename ), "w" ) as fh:
+            for line in lines:
+                fh.write( "%s\n" % line )
+            fh.close()
+
+    def test_load_every_list( self ):
+        todo_lists = TodoLists.load( self.todo_dir )
+
+        self.assertEqual( [ todo_list.name for todo_list in todo_lists.lists ],
+                [ "todo", "work" ] )
+        self.assertEqual( len( todo_lists ), 5 )
+
+    def test_query_numbers_across_lists_in_text_order( self ):
+        results = TodoLists.load( self.todo_dir ).query()
+
+        self.assertEqual( [ ( number, task.text, task.list_name, task.number )
+            for ( number, task ) in results ], [
+                ( 3, "a work", "work", 1 ),
+                ( 1, "b home", "todo", 1 ),
+                ( 4, "c work", "work", 2 ),
+                ( 2, "d home", "todo", 2 ),
+                ( 5, "e work", "work", 3 ) ] )
+
+    def test_query_terms( self ):
+        results = TodoLists.load( self.todo_dir ).query( [ "work" ] )
+
+        self.assertEqual( [ number for ( number, task ) in results ],
+                [ 3, 4, 5 ] )
+
+    def test_stats( self ):
+        stats = dict( TodoLists.load( self.todo_dir ).stats() )
+
+        self.assertEqual( stats[ "todo" ][ "tasks" ], 2 )
+        self.assertEqual( stats[ "work" ][ "tasks" ], 3 )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,6 +9,8 @@
 import sys
 import os
 import shutil
+import hashlib
+import struct
 
 import logging
 import argparse
@@ -16,7 +18,16 @@ import re
 import inspect
 import ConfigParser
 
-from datetime import date
+from array import array
+from datetime import date, datetime
+from heapq import merge
+from multiprocessing.pool import ThreadPool
+
+# numpy is optional, it speeds up the analyze action on long histories.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 ###############################################################################
@@ -26,14 +37,27 @@ usage_doc = "%(prog)s [options] action [task_number] [task_description]"
 longhelp_doc = """
 Built-in Actions:
 
-  add "THING I NEED TO DO +project @context"
-  a "THING I NEED TO DO +project @context"
+  add [--force] "THING I NEED TO DO +project @context"
+  a [--force] "THING I NEED TO DO +project @context"
     Adds THINK I NEED TO DO to your todo.txt file on its own line.
     Project and context notation optional. 
+    If the same task is already open (ignoring creation date, priority and
+    tag order) it is rejected or merged, see 'duplicate_tasks' in the cfg
+    file. Use --force to add it anyway.
+
+  analyze [week|month]
+  analyze project|context|priority [week|month]
+    Analyses the tasks archived in done.txt. With no arguments, displays
+    the number completed, the throughput and the lead time from creation
+    to completion. 'week' or 'month' displays the number completed in each
+    period. 'project', 'context' or 'priority' counts the tasks completed
+    in each one, in each period if one is given.
+    A snapshot of done.txt is kept in done.snapshot, and brought up to date
+    as tasks are archived.
 
   archive
     Move all ITEMs marked as done (preceeded with X) from the todo.txt file to
-    a done.txt file. Done ITEMS will no longer appear in the todo list when 
+    a done.txt file. Done ITEMS will no longer appear in the todo list when
     displayed.
 
   depri ITEM#[, ITEM#, ITEM#, ...]
@@ -44,6 +68,10 @@ Built-in Actions:
   do ITEM#[, ITEM#, ITEM#, ...]
     Marks task(s) on line ITEM# as done in todo.txt
 
+  dedupe [done]
+    Lists clusters of duplicate tasks in todo.txt, ignoring creation date,
+    priority and tag order. If 'done' is specified, done.txt is searched too.
+
   del ITEM# 
   rm ITEM# 
     Deletes the task on line ITEM# in todo.txt.
@@ -64,20 +92,55 @@ Built-in Actions:
     prioritized, replaces current priority with new PRIORITY.
     PRIORITY must be a letter between A and Z.
 
+  restore [GENERATION#]
+    Every change is backed up in the 'backup' directory of the todo
+    directory, see 'backup_generations' in the cfg file. With no argument,
+    lists the backup generations, newest first. Otherwise rolls todo.txt
+    and done.txt back to how they were before GENERATION# was made. What
+    the restore removes is backed up as a new generation, so it can be
+    undone by restoring that generation.
+
   shorthelp
-    List the one-line usage of all built-in actions."""
+    List the one-line usage of all built-in actions.
+
+  stats
+    Displays the number of tasks, done tasks and prioritised tasks.
+
+  sync DIRECTORY
+    Merges todo.txt with the todo.txt in another todo DIRECTORY, e.g. a
+    shared or mounted copy. Tasks added, changed or deleted on either side
+    since the last sync are kept. If a task was changed on both sides, the
+    done one wins, otherwise the most recently changed file wins. Both
+    done.txt files get the archived tasks they are missing.
+
+Lists:
+
+  The todo directory can hold more than one list. The -l/--list NAME option
+  selects the list an action works on; list NAME is kept in NAME.txt and 
+  archived to NAME-done.txt. The default list is 'todo', using todo.txt and
+  done.txt. Every other .txt file in the todo directory is taken to be a
+  list, except todo.sh's report.txt, so keep notes in other file types.
+
+  -l all can be used with the list and stats actions to read every list in
+  parallel. Tasks are numbered across all lists and each is followed by its
+  [NAME:ITEM#] for use with -l NAME."""
     
 shorthelp_doc = """
 Actions:
-  add|a "THING I NEED TO DO +project @context"
+  add|a [--force] "THING I NEED TO DO +project @context"
+  analyze [project|context|priority] [week|month]
   archive
+  dedupe [done]
   del|rm ITEM# [TERM]
   depri|dp ITEM#[, ITEM#, ITEM#, ...]
   do ITEM#[, ITEM#, ITEM#, ...]
   help
   list|ls [TERM...]
   pri|p ITEM# PRIORITY
-  shorthelp """
+  restore [GENERATION#]
+  shorthelp
+  stats
+  sync DIRECTORY """
 
 description_doc = """
 For detailed instructions on 'action' commands, use: 
@@ -97,6 +160,14 @@ colour_mode = true
 ; Default action to perform if todo.py is called with no action command
 default_action = list
 
+; Number of backup generations kept in the 'backup' directory, 0 for none.
+backup_generations = 10
+
+; What to do when adding a task that is already open. Values - 'reject',
+; 'merge' (apply the new priority to the existing task) or 'allow'.
+; The add --force option always adds the task.
+duplicate_tasks = reject
+
 ; ANSI colour codes to be used - overrides the defaults used.
 ; WARNING: incorrect colour codes can make output unreadable.
 ;BLACK          = [0;30m
@@ -168,7 +239,9 @@ DEFAULT = '\033[0m'
 # Regexs
 
 # ISO 8601 format date strings
-# date_re = re.compile( "(\d{4}-\d{2}-\d{2})\s" )
+date_re = re.compile( "^(\d{4})-(\d{2})-(\d{2})(\s|$)" )
+
+done_date_re = re.compile( "^x\s+(\d{4})-(\d{2})-(\d{2})(\s|$)" )
 
 priority_re = re.compile( "^\(([A-Z])\)" )
 
@@ -180,6 +253,15 @@ done_re = re.compile( "^x\s" )
 
 line_no_re = re.compile( "(^\d+\s+)(\S.*)" )
 
+list_name_re = re.compile( "^\w[\w-]*$" )
+
+# Prefixes ignored when comparing tasks for duplicates
+done_prefix_re = re.compile( "^x\s+(\d{4}-\d{2}-\d{2}\s+)?" )
+
+priority_prefix_re = re.compile( "^\([A-Z]\)\s+" )
+
+date_prefix_re = re.compile( "^\d{4}-\d{2}-\d{2}\s+" )
+
 
 ###############################################################################
 
@@ -203,27 +285,6 @@ def todo_error( err_msg ):
     "Displays runtime error message and exits"
     sys.exit( "--\nTODO:\tERROR: %s" % err_msg )
 
-def add_line_numbers( lines ):
-    "Add a line number to a list of strings"
-    line_no = 1
-    new_lines = []
-    for line in lines:
-        line = " ".join( [ "%-3d" % line_no, line ] )
-        new_lines.append( line )
-        line_no += 1
-    return new_lines
-
-def remove_line_no( line ):
-    "Remove the line number from the start of the string"
-    res = line_no_re.match( line )
-    if res:
-        return res.groups()[1]
-    else: 
-        return line
-
-def remove_line_numbers( lines ):
-    return map( remove_line_no, lines )
-    
 def build_term_filter( words ):
     "Build and return a regexe AND filter on the word list imported"
     debug( "Words to filter list on" )
@@ -235,6 +296,149 @@ def build_term_filter( words ):
 
     return "".join( term_f )
 
+def normalise_task( task ):
+    """
+    Reduce a task to the text that identifies it. The completion marker,
+    priority and creation date are removed and +project/@context tags are
+    sorted, so that re-added copies of a task compare equal.
+    """
+    task = done_prefix_re.sub( "", task.strip() )
+
+    # add puts the creation date before any priority given with the task
+    for prefix_re in [ priority_prefix_re, date_prefix_re ] * 2:
+        task = prefix_re.sub( "", task )
+
+    words = []
+    tags = []
+    for word in task.split():
+        if len( word ) > 1 and word[0] in "+@":
+            tags.append( word )
+        else:
+            words.append( word )
+
+    return " ".join( words + sorted( tags ) )
+
+def remove_priority( task ):
+    "Remove the priority from a task, whether before or after its date"
+    res = date_prefix_re.match( task )
+    if res:
+        return res.group( 0 ) + priority_prefix_re.sub( "", task[ res.end(): ] )
+    return priority_prefix_re.sub( "", task ).strip()
+
+def task_hash( task ):
+    "Hash of the normalised task text, used to detect duplicates"
+    return hashlib.sha1( normalise_task( task ) ).digest()
+
+def line_hash( line ):
+    "Hash of the exact line, as recorded in sync base files"
+    return hashlib.sha1( line ).hexdigest()
+
+def resolve_conflict( line, other, other_newer ):
+    "Choose between two changed versions of a task. Done wins, then newest"
+    if done_re.match( line ) and not done_re.match( other ):
+        return line
+    if done_re.match( other ) and not done_re.match( line ):
+        return other
+    if other_newer:
+        return other
+    return line
+
+def list_files( todo_dir, name ):
+    "Return the todo and done file names of the named list"
+    if name == "todo":
+        return ( os.path.join( todo_dir, "todo.txt" ),
+                 os.path.join( todo_dir, "done.txt" ) )
+
+    return ( os.path.join( todo_dir, "%s.txt" % name ),
+             os.path.join( todo_dir, "%s-done.txt" % name ) )
+
+def list_names( todo_dir ):
+    "Return the names of the lists in todo_dir, the default list first"
+    names = []
+    for filename in os.listdir( todo_dir ):
+        ( name, ext ) = os.path.splitext( filename )
+        if ext == ".txt" and valid_list_name( name ):
+            names.append( name )
+
+    names.sort( key=lambda name: ( name != "todo", name ) )
+    return names
+
+def valid_list_name( name ):
+    """
+    Check name can be used for a list without clashing with a done file,
+    or with the report.txt that todo.sh keeps in the todo directory
+    """
+    return bool( list_name_re.match( name ) ) and \
+        name not in ( "done", "all", "report" ) and \
+        not name.endswith( "-done" )
+
+def parallel_map( func, items, threads=8 ):
+    "Map func over items using a pool of up to threads threads"
+    if len( items ) < 2:
+        return map( func, items )
+
+    pool = ThreadPool( min( len( items ), threads ) )
+    try:
+        return pool.map( func, items )
+    finally:
+        pool.close()
+        pool.join()
+
+def date_ordinal( res ):
+    "Convert a date_re match to a date ordinal, 0 if it isn't a real date"
+    try:
+        return date( *[ int( part ) for part in res.groups()[:3] ] ).toordinal()
+    except ValueError:
+        return 0
+
+def vector( values ):
+    "Return a typed array of ints as a numpy array, sharing its buffer"
+    if not len( values ):
+        return numpy.zeros( 0, dtype=values.typecode )
+    return numpy.frombuffer( values, dtype=values.typecode )
+
+def count_values( values ):
+    "Count each distinct int in values, returned as a dictionary"
+    if numpy is not None:
+        ( keys, counts ) = numpy.unique( values, return_counts=True )
+        return dict( zip( keys.tolist(), counts.tolist() ) )
+
+    counts = {}
+    for value in values:
+        counts[ value ] = counts.get( value, 0 ) + 1
+    return counts
+
+def period_start( ordinal, period ):
+    "Return the ordinal of the first day of the week or month of ordinal"
+    if period == "week":
+        # Ordinal 1 was a Monday
+        return ( ordinal - 1 ) // 7 * 7 + 1
+
+    day = date.fromordinal( ordinal )
+    return date( day.year, day.month, 1 ).toordinal()
+
+def file_mtime( filename ):
+    "Modification time of filename, or 0 if it doesn't exist"
+    if os.path.exists( filename ):
+        return os.path.getmtime( filename )
+    return 0
+
+def link_file( source, target ):
+    "Hard link source to target, copying it if links aren't supported"
+    try:
+        os.link( source, target )
+    except ( AttributeError, OSError ):
+        shutil.copyfile( source, target )
+
+def replace_file( source, target ):
+    "Rename source over target"
+    try:
+        os.rename( source, target )
+    except OSError:
+        # Windows won't rename over an existing file
+        os.remove( target )
+        os.rename( source, target )
+
 def create_default_cfg_file( cfg_filename ):
     """
     Creates the default config file and sets the todo directory as being
@@ -319,36 +523,1175 @@ def str_to_int( value ):
 
 ###############################################################################
 #
-# todo Class
+# Backups Class
 #
 ###############################################################################
 
-class todo( object ):
-    "Class to manage todo actions"
+class Backups( object ):
+    """
+    Generations of backups in the 'backup' directory of a todo directory,
+    one sub-directory per change. Todo files are always replaced rather
+    than rewritten, so the old file is hard linked into the generation
+    instead of copied. Done files are only appended to, so just the size
+    they had before the append is recorded, along with any tail that a
+    restore cut off.
+    """
+
+    def __init__( self, todo_dir, generations=10 ):
+        self.backup_dir = os.path.join( todo_dir, "backup" )
+        self.generations = generations
+
+    def create( self ):
+        "Create a new generation and return its name"
+        if not os.path.exists( self.backup_dir ):
+            os.makedirs( self.backup_dir )
+
+        name = datetime.now().strftime( "%Y%m%d-%H%M%S-%f" )
+        while os.path.exists( os.path.join( self.backup_dir, name ) ):
+            name += "a"
+        os.mkdir( os.path.join( self.backup_dir, name ) )
+
+        return name
+
+    def names( self, filenames=None ):
+        """
+        Return the generation names, newest first. If filenames are given,
+        only the generations that backed up one of them.
+        """
+        if not os.path.exists( self.backup_dir ):
+            return []
+
+        names = sorted( [ name for name in os.listdir( self.backup_dir )
+            if self.taken( name ) and
+            os.path.isdir( os.path.join( self.backup_dir, name ) ) ],
+            reverse=True )
+        if filenames is None:
+            return names
+
+        return [ name for name in names if self.files( name, filenames ) ]
+
+    def files( self, name, filenames ):
+        "Return the filenames backed up in generation name"
+        contents = os.listdir( os.path.join( self.backup_dir, name ) )
+
+        return [ filename for filename in filenames
+                if os.path.basename( filename ) in contents or
+                os.path.basename( filename ) + ".append" in contents or
+                os.path.basename( filename ) + ".tail" in contents ]
+
+    def prune( self, filenames ):
+        """
+        Remove the oldest generations of filenames, keeping the newest 
+        generations of them. Lists share the backup directory, so the
+        backups of other files are left alone.
+        """
+        for name in self.names( filenames )[ self.generations: ]:
+            shutil.rmtree( os.path.join( self.backup_dir, name ) )
+
+    def record_append( self, name, filename ):
+        "Record the size of filename, before it's appended to"
+        size = 0
+        if os.path.exists( filename ):
+            size = os.path.getsize( filename )
+
+        record = os.path.join( self.backup_dir, name,
+                os.path.basename( filename ) + ".append" )
+        with open( record, "w" ) as fh:
+            fh.write( "%d\n" % size )
+            fh.close()
+
+    def read_tail( self, name, filename ):
+        "Return the ( size, tail ) cut from filename in generation name"
+        record = os.path.join( self.backup_dir, name,
+                os.path.basename( filename ) + ".tail" )
+        with open( record, "rb" ) as fh:
+            size = int( fh.readline() )
+            tail = fh.read()
+            fh.close()
+        return ( size, tail )
+
+    def record_tail( self, name, filename, size, tail ):
+        "Record the tail cut from filename at size, so it can be put back"
+        record = os.path.join( self.backup_dir, name,
+                os.path.basename( filename ) + ".tail" )
+        with open( record, "wb" ) as fh:
+            fh.write( "%d\n" % size )
+            fh.write( tail )
+            fh.close()
+
+    def restore( self, name, filenames, undo=None ):
+        """
+        Roll filenames back to how they were before generation name. Each
+        file is restored from the oldest generation since then that backed
+        it up. What the restore removes is backed up in generation undo, if
+        one is given, so that the restore can itself be undone.
+        """
+        names = [ later for later in self.names() 
+                if later >= name and later != undo ]
+        names.reverse()
+
+        for filename in filenames:
+            basename = os.path.basename( filename )
+            for ( index, later ) in enumerate( names ):
+                backup = os.path.join( self.backup_dir, later, basename )
+
+                if os.path.exists( backup ):
+                    if undo:
+                        self.snapshot( undo, filename )
+
+                    # Copied rather than linked, other programs may write
+                    # to the todo file in place.
+                    shutil.copyfile( backup, filename + ".tmp" )
+                    replace_file( filename + ".tmp", filename )
+                    break
+
+                if os.path.exists( backup + ".append" ):
+                    with open( backup + ".append" ) as fh:
+                        size = int( fh.read() )
+                        fh.close()
+
+                    self.__rewind( filename, size, "", undo, names[ index + 1: ] )
+                    break
+
+                if os.path.exists( backup + ".tail" ):
+                    ( size, tail ) = self.read_tail( later, filename )
+                    self.__rewind( filename, size, tail, undo, names[ index + 1: ] )
+                    break
+
+        # Nothing needed rolling back
+        if undo and not os.listdir( os.path.join( self.backup_dir, undo ) ):
+            os.rmdir( os.path.join( self.backup_dir, undo ) )
+
+    def __rewind( self, filename, size, tail, undo, names ):
+        """
+        Cut filename back to size, then append tail. The cut is recorded in
+        generation undo, otherwise the size before the append is.
+
+        If the file is shorter than size, it was cut further back by an 
+        earlier restore. The bytes it is missing are taken from the tail
+        that restore recorded in one of names; without them the file is
+        left alone, it is never padded out.
+        """
+        current = 0
+        if os.path.exists( filename ):
+            current = os.path.getsize( filename )
+
+        if current < size:
+            for name in names:
+                if not os.path.exists( os.path.join( self.backup_dir, name,
+                        os.path.basename( filename ) + ".tail" ) ):
+                    continue
+
+                ( cut_size, cut ) = self.read_tail( name, filename )
+                if cut_size <= current and size <= cut_size + len( cut ):
+                    tail = cut[ current - cut_size : size - cut_size ] + tail
+                    size = current
+                    break
+            else:
+                return
+
+        if current > size:
+            with open( filename, "r+b" ) as fh:
+                if undo:
+                    fh.seek( size )
+                    self.record_tail( undo, filename, size, fh.read() )
+                fh.truncate( size )
+                fh.close()
+        elif undo and tail:
+            self.record_append( undo, filename )
+
+        if tail:
+            with open( filename, "ab" ) as fh:
+                fh.write( tail )
+                fh.close()
+
+    def snapshot( self, name, filename ):
+        "Back up filename, which is about to be replaced"
+        backup = os.path.join( self.backup_dir, name,
+                os.path.basename( filename ) )
+
+        if os.path.exists( filename ):
+            link_file( filename, backup )
+        else:
+            # Restoring a list that didn't exist empties it
+            open( backup, "w" ).close()
+
+    def taken( self, name ):
+        "Return when generation name was made, or None if it isn't one"
+        try:
+            return datetime.strptime( name[:15], "%Y%m%d-%H%M%S" )
+        except ValueError:
+            return None
+
+
+###############################################################################
+#
+# DoneSnapshot Class
+#
+###############################################################################
+
+class DoneSnapshot( object ):
+    """
+    A columnar snapshot of a done file, for analysing completed tasks
+    without parsing the file each time. Each done task is a row in typed
+    arrays of completion and creation date ordinals (0 if not dated) and
+    priority codes (1 for A to 26 for Z, 0 for none). A task can have
+    several projects and contexts, so they are kept as ( row, id ) pairs
+    of arrays with the ids indexing lists of names.
+
+    The snapshot records how much of the done file it has read. As the
+    done file is only appended to, bringing it up to date parses just the
+    new lines. If the file has shrunk or changed it is read again.
+    """
+
+    magic = "TODOCOL1"
+
+    columns = [ "completed", "created", "priority", "project_rows",
+            "project_ids", "context_rows", "context_ids" ]
+
+    def __init__( self, done_file ):
+        self.done_file = done_file
+        self.snapshot_file = os.path.splitext( done_file )[0] + ".snapshot"
+        self.clear()
+
+    @classmethod
+    def load( cls, done_file ):
+        "Load the snapshot of done_file, bringing it up to date"
+        snapshot = cls( done_file )
+
+        if os.path.exists( snapshot.snapshot_file ):
+            snapshot.read()
+
+        if snapshot.update():
+            snapshot.save()
+
+        return snapshot
+
+    def __len__( self ):
+        return len( self.completed )
+
+    def __add_line( self, line ):
+        "Add a row for a done task, if it has a completion date"
+        res = done_date_re.match( line )
+        if not res:
+            return
+
+        completed = date_ordinal( res )
+        if not completed:
+            return
+
+        created = 0
+        priority = 0
+
+        # Done tasks keep any priority and creation date, in either order
+        text = line[ res.end(): ].lstrip()
+        for prefix in range( 2 ):
+            res = priority_re.match( text )
+            if res and not priority:
+                priority = ord( res.groups()[0] ) - ord( "A" ) + 1
+                text = text[ res.end(): ].lstrip()
+
+            res = date_re.match( text )
+            if res and not created:
+                created = date_ordinal( res )
+                text = text[ res.end(): ].lstrip()
+
+        row = len( self.completed )
+        self.completed.append( completed )
+        self.created.append( created )
+        self.priority.append( priority )
+
+        for tag in project_re.findall( " " + text ):
+            self.project_rows.append( row )
+            self.project_ids.append( self.__tag_id(
+                tag[2:], self.projects, self.__project_ids ) )
+
+        for tag in context_re.findall( " " + text ):
+            self.context_rows.append( row )
+            self.context_ids.append( self.__tag_id(
+                tag[2:], self.contexts, self.__context_ids ) )
+
+    def __tag_id( self, tag, names, ids ):
+        "Look up the id of a project or context, adding it if it's new"
+        if tag not in ids:
+            ids[ tag ] = len( names )
+            names.append( tag )
+        return ids[ tag ]
+
+    def __tail_hash( self, fh, size ):
+        "Hash the end of the part of the done file read so far"
+        start = max( 0, size - 256 )
+        fh.seek( start )
+        return hashlib.sha1( fh.read( size - start ) ).digest()
+
+    def clear( self ):
+        "Empty the snapshot"
+        self.size = 0
+        self.tail = hashlib.sha1( "" ).digest()
+
+        self.completed = array( "i" )
+        self.created = array( "i" )
+        self.priority = array( "b" )
+        self.project_rows = array( "i" )
+        self.project_ids = array( "i" )
+        self.context_rows = array( "i" )
+        self.context_ids = array( "i" )
+
+        self.projects = []
+        self.contexts = []
+        self.__project_ids = {}
+        self.__context_ids = {}
+
+    def read( self ):
+        "Read the snapshot file. A snapshot that can't be read is cleared"
+        try:
+            with open( self.snapshot_file, "rb" ) as fh:
+                if fh.read( len( self.magic ) ) != self.magic:
+                    raise ValueError( "Not a snapshot file" )
+
+                ( self.size, self.tail, byteorder ) = struct.unpack(
+                        "<Q20sc", fh.read( 29 ) )
+
+                # The arrays are stored in the machine's byte order
+                if byteorder != sys.byteorder[0]:
+                    raise ValueError( "Snapshot byte order differs" )
+
+                for name in self.columns:
+                    ( typecode, length ) = struct.unpack( "<cI", fh.read( 5 ) )
+                    column = array( typecode )
+                    column.fromfile( fh, length )
+                    setattr( self, name, column )
+
+                for names in ( self.projects, self.contexts ):
+                    ( length, ) = struct.unpack( "<I", fh.read( 4 ) )
+                    names.extend( fh.read( length ).split( "\n" ) )
+                    if names == [ "" ]:
+                        names.pop()
+
+                fh.close()
+
+        except ( IOError, EOFError, ValueError, struct.error ) as err:
+            debug( "Rebuilding snapshot, %s" % err )
+            self.clear()
+            return
+
+        self.__project_ids = dict(
+                [ ( name, id ) for ( id, name ) in enumerate( self.projects ) ] )
+        self.__context_ids = dict(
+                [ ( name, id ) for ( id, name ) in enumerate( self.contexts ) ] )
+
+    def save( self ):
+        "Write the snapshot file"
+        with open( self.snapshot_file + ".tmp", "wb" ) as fh:
+            fh.write( self.magic )
+            fh.write( struct.pack(
+                "<Q20sc", self.size, self.tail, sys.byteorder[0] ) )
+
+            for name in self.columns:
+                column = getattr( self, name )
+                fh.write( struct.pack( "<cI", column.typecode, len( column ) ) )
+                column.tofile( fh )
+
+            for names in ( self.projects, self.contexts ):
+                text = "\n".join( names )
+                fh.write( struct.pack( "<I", len( text ) ) )
+                fh.write( text )
+
+            fh.close()
+
+        replace_file( self.snapshot_file + ".tmp", self.snapshot_file )
+
+    def update( self ):
+        """
+        Add the lines appended to the done file since the snapshot was
+        taken. Returns True if the snapshot changed.
+        """
+        if not os.path.exists( self.done_file ):
+            changed = self.size > 0
+            self.clear()
+            return changed
+
+        changed = False
+        with open( self.done_file, "rb" ) as fh:
+            fh.seek( 0, os.SEEK_END )
+            end = fh.tell()
+
+            # The done file was restored or edited, start again.
+            if end < self.size or self.__tail_hash( fh, self.size ) != self.tail:
+                self.clear()
+                changed = True
+
+            fh.seek( self.size )
+            data = fh.read( end - self.size )
+
+            # Leave any partly written last line for next time
+            data = data[ : data.rfind( "\n" ) + 1 ]
+            if data:
+                for line in data.splitlines():
+                    self.__add_line( line.strip() )
+
+                self.size += len( data )
+                self.tail = self.__tail_hash( fh, self.size )
+                changed = True
+
+            fh.close()
+
+        return changed
+
+    def completions( self, period="week" ):
+        """
+        Return ( period start date, count ) pairs for every week or month
+        from the first task completed to the last.
+        """
+        counts = count_values( self.periods( period ) )
+        if not counts:
+            return []
+
+        starts = [ min( counts ) ]
+        while starts[-1] < max( counts ):
+            # Any day in the next period will do, as the start is found
+            starts.append( period_start( starts[-1] + 31, period )
+                    if period == "month" else starts[-1] + 7 )
+
+        return [ ( date.fromordinal( start ), counts.get( start, 0 ) )
+                for start in starts ]
+
+    def counts( self, group, period=None ):
+        """
+        Count the tasks completed in each project, context or priority, and
+        in each week or month if period is given. Returns a dictionary
+        keyed by ( name, period start date or None ).
+        """
+        if group == "project":
+            ( rows, ids, names ) = (
+                    self.project_rows, self.project_ids, self.projects )
+        elif group == "context":
+            ( rows, ids, names ) = (
+                    self.context_rows, self.context_ids, self.contexts )
+        elif group == "priority":
+            rows = None
+            ids = self.priority
+            names = [ "none" ] + [ chr( code )
+                    for code in range( ord( "A" ), ord( "Z" ) + 1 ) ]
+        else:
+            raise TodoError(
+                    "GROUP must be project, context or priority, not \"%s\"" %
+                    group )
+
+        # Combine each period and id into one key to count them together
+        keys = ids
+        if numpy is not None:
+            keys = vector( ids ).astype( numpy.int64 )
+        if period:
+            periods = self.periods( period )
+            if numpy is not None:
+                if rows is not None:
+                    periods = periods[ vector( rows ) ]
+                keys = periods.astype( numpy.int64 ) * len( names ) + keys
+            else:
+                if rows is not None:
+                    periods = [ periods[ row ] for row in rows ]
+                keys = [ start * len( names ) + id
+                        for ( start, id ) in zip( periods, ids ) ]
+
+        counts = {}
+        for ( key, count ) in count_values( keys ).items():
+            if period:
+                ( start, id ) = divmod( key, len( names ) )
+                counts[ ( names[ id ], date.fromordinal( start ) ) ] = count
+            else:
+                counts[ ( names[ key ], None ) ] = count
+
+        return counts
+
+    def lead_times( self ):
+        """
+        Return statistics of the days from creation to completion, over the
+        tasks that have a creation date, as a dictionary.
+        """
+        if numpy is not None:
+            created = vector( self.created )
+            days = vector( self.completed )[ created > 0 ] - created[ created > 0 ]
+            days = numpy.sort( days[ days >= 0 ] ).tolist()
+        else:
+            days = sorted( [ completed - created for ( completed, created )
+                in zip( self.completed, self.created )
+                if created and completed >= created ] )
+
+        if not days:
+            return { "tasks": 0, "mean": 0, "median": 0, "max": 0 }
+
+        middle = len( days ) // 2
+        median = days[ middle ]
+        if not len( days ) % 2:
+            median = ( days[ middle - 1 ] + days[ middle ] ) / 2.0
+
+        return {
+                "tasks":    len( days ),
+                "mean":     float( sum( days ) ) / len( days ),
+                "median":   median,
+                "max":      days[-1]
+                }
+
+    def periods( self, period="week" ):
+        "Return the start ordinal of the week or month each task was done in"
+        if period == "week":
+            if numpy is not None:
+                return ( vector( self.completed ) - 1 ) // 7 * 7 + 1
+            return array( "i", [ period_start( ordinal, period )
+                for ordinal in self.completed ] )
+
+        if period == "month":
+            # Only look up the month of each distinct day once
+            starts = dict( [ ( ordinal, period_start( ordinal, period ) )
+                for ordinal in set( self.completed ) ] )
+            if numpy is not None:
+                ordinals = vector( self.completed )
+                ( days, index ) = numpy.unique( ordinals, return_inverse=True )
+                return numpy.array( [ starts[ day ] for day in days.tolist() ],
+                        dtype=numpy.int32 )[ index ]
+            return array( "i", [ starts[ ordinal ]
+                for ordinal in self.completed ] )
+
+        raise TodoError( "PERIOD must be week or month, not \"%s\"" % period )
+
+
+###############################################################################
+#
+# TodoList Class
+#
+###############################################################################
+
+class TodoError( Exception ):
+    "Raised by TodoList when an action cannot be carried out"
+
+    def __init__( self, message, task=None ):
+        Exception.__init__( self, message )
+        self.task = task
+
+class DuplicateTaskError( TodoError ):
+    "Raised by TodoList.add when the task is already open"
+
+
+class Task( object ):
+    "A task and its ITEM# in the file it was read from"
+
+    def __init__( self, text, number=None, source="todo.txt", list_name="todo" ):
+        self.text = text
+        self.number = number
+        self.source = source
+        self.list_name = list_name
+
+    def __str__( self ):
+        return self.text
+
+    def __repr__( self ):
+        return "Task(%r, %r, %r, %r)" % ( 
+                self.text, self.number, self.source, self.list_name )
+
+    @property
+    def done( self ):
+        return bool( done_re.match( self.text ) )
+
+    @property
+    def priority( self ):
+        "The priority letter, or None if the task has no priority"
+        # add puts the creation date before any priority given with the task
+        res = priority_re.match( date_prefix_re.sub( "", self.text ) )
+        if res:
+            return res.groups()[0]
+        return None
+
+    @property
+    def projects( self ):
+        return [ tag[2:] for tag in project_re.findall( " " + self.text ) ]
+
+    @property
+    def contexts( self ):
+        return [ tag[2:] for tag in context_re.findall( " " + self.text ) ]
+
+
+class TodoList( object ):
+    """
+    The tasks in a todo directory. 
+    Actions change the list in memory and return Task objects; nothing is 
+    written until save() is called. Errors are raised as TodoError, the 
+    list never prints or exits so it can be used from other programs.
+
+    A Task's number is its line number when it was returned. delete and
+    archive remove lines and save() sorts them, so numbers held from before
+    then may refer to another task; query the list again to renumber.
+    """
+
+    def __init__( self, todo_dir, name="todo", backups=10 ):
+        if not valid_list_name( name ):
+            raise TodoError( "\"%s\" cannot be used as a list name." % name )
+
+        self.todo_dir = todo_dir
+        self.name = name
+        ( self.todo_file, self.done_file ) = list_files( todo_dir, name )
+        self.backups = Backups( todo_dir, backups )
+
+        self.__lines = []
+        self.__archived = []
+        self.__sync_base = None
+
+        # Hash of each open task to its line index, see __open_tasks()
+        self.__open_task_index = None
+
+    @classmethod
+    def load( cls, todo_dir, name="todo", backups=10 ):
+        """
+        Load the named todo list from todo_dir. Up to backups generations
+        of backups are kept when it's saved.
+        """
+        todo_list = cls( todo_dir, name, backups )
+        todo_list.__read()
+        return todo_list
+
+    def __read( self ):
+        "Read the tasks from the todo file"
+        self.__lines = []
+        self.__open_task_index = None
 
-    def __init__( self, todo_dir, **kwargs ):
-        "Load the todo list"
-        self.todo_file = os.path.join( todo_dir, "todo.txt" )
-        self.done_file = os.path.join( todo_dir, "done.txt" )
-        
         if os.path.exists( self.todo_file ):
             with open( self.todo_file ) as fh:
-                self.__lines = fh.readlines()
+                # remove Carriage returns.
+                self.__lines = [ line.strip() for line in fh ]
                 fh.close()
-        else:
-            self.__lines = []
 
-        self.__list_size = len( self.__lines )
+    def __len__( self ):
+        return len( self.__lines )
+
+    def task( self, number ):
+        "Return the task on line number"
+
+        if number < 1 or number > len( self.__lines ):
+            raise TodoError( "%d is outside todo list range." % number )
+
+        return self.__task( self.__lines[ number - 1 ], number )
+
+    def tasks( self ):
+        "Return all tasks in file order"
+        return [ self.__task( line, number ) 
+                for ( number, line ) in enumerate( self.__lines, 1 ) ]
+
+    def __task( self, text, number=None, filename=None ):
+        "Create a Task read from filename, by default the todo file"
+        source = os.path.basename( filename or self.todo_file )
+        return Task( text, number, source, self.name )
+
+    def add( self, text, force=False ):
+        """
+        Add a new task, dated today. Raises DuplicateTaskError if the same
+        task is already open, unless force is set.
+        """
+
+        # prepend the date to the start of the task
+        task = " ".join( [ date.today().strftime("%Y-%m-%d"), text ] )
+
+        if not force:
+            duplicate = self.find_duplicate( task )
+            if duplicate:
+                raise DuplicateTaskError( 
+                        "Task %d is a duplicate" % duplicate.number, 
+                        duplicate 
+                        )
+
+        self.__lines.append( task )
+        if self.__open_task_index is not None:
+            self.__open_task_index.setdefault( 
+                    task_hash( task ), len( self.__lines ) - 1 )
+        return self.__task( task, len( self.__lines ) )
+
+    def archive( self ):
+        """
+        Remove all completed tasks from the list, they are appended to the
+        done file by save(). Returns the archived tasks.
+        """
+
+        completed = [ task for task in self.__lines if done_re.match( task ) ]
+
+        # Can't archive if not tasks are completed
+        if not completed:
+            raise TodoError( "No tasks marked done." )
+
+        # just in case.
+        completed.sort()
+
+        self.__open_task_index = None
+        self.__lines = [ 
+                task for task in self.__lines if not done_re.match( task ) 
+                ]
+        self.__archived.extend( completed )
+
+        return [ self.__task( task, filename=self.done_file ) 
+                for task in completed ]
+
+    def complete( self, number ):
+        "Mark the task on line number as done, adding a completion date"
+        task = self.task( number )
+
+        # Check the task hasn't already been marked done.
+        if not task.done:
+            task.text = " ".join( [
+                "x",
+                date.today().strftime("%Y-%m-%d"),
+                task.text
+                ] )
+            self.__lines[ number - 1 ] = task.text
+            self.__open_task_index = None
+
+        return task
 
-        # remove Carriage returns.
-        self.__lines = [line.strip() for line in self.__lines]
+    def delete( self, numbers ):
+        "Delete the tasks on the listed line numbers"
+        tasks = [ self.task( number ) for number in set( numbers ) ]
 
+        # Delete from the bottom up so the line numbers stay valid.
+        tasks.sort( key=lambda task: task.number, reverse=True )
+        for task in tasks:
+            del self.__lines[ task.number - 1 ]
+        self.__open_task_index = None
+
+        tasks.reverse()
+        return tasks
+
+    def deprioritise( self, number ):
+        "Remove the priority from the task on line number"
+        task = self.task( number )
+
+        # Check the task hasn't already been completed
+        if task.done:
+            raise TodoError( "Task completed", task )
+
+        if not task.priority:
+            raise TodoError( "No priority", task )
+
+        task.text = remove_priority( task.text )
+        self.__lines[ number - 1 ] = task.text
+
+        return task
+
+    def done_tasks( self ):
+        "Return the tasks in the done file, numbered by line"
+        if not os.path.exists( self.done_file ):
+            return []
+
+        with open( self.done_file ) as fh:
+            tasks = [ self.__task( line.strip(), number, self.done_file ) 
+                    for ( number, line ) in enumerate( fh, 1 ) ]
+            fh.close()
+
+        return tasks
+
+    def duplicates( self, include_done=False ):
+        """
+        Return the clusters of tasks that are the same, ignoring creation 
+        date, priority and tag order. Found in a single pass over the tasks.
+        """
+        tasks = self.tasks()
+        if include_done:
+            tasks.extend( self.done_tasks() )
+
+        clusters = {}
+        order = []
+        for task in tasks:
+            if task.text:
+                key = task_hash( task.text )
+                if key not in clusters:
+                    clusters[ key ] = []
+                    order.append( key )
+                clusters[ key ].append( task )
+
+        return [ clusters[ key ] for key in order if len( clusters[ key ] ) > 1 ]
+
+    def find_duplicate( self, text ):
+        "Return the open task that text duplicates, or None"
+        index = self.__open_tasks().get( task_hash( text ) )
+        if index is None:
+            return None
+        return self.task( index + 1 )
+
+    def __open_tasks( self ):
+        """
+        Map the hash of each open task to its line index. The map is built
+        on first use and kept up to date by add; changes that move or
+        remove lines clear it. Changing a priority leaves the hash alone.
+        """
+        if self.__open_task_index is None:
+            self.__open_task_index = {}
+            for ( index, line ) in enumerate( self.__lines ):
+                if not done_re.match( line ):
+                    self.__open_task_index.setdefault( task_hash( line ), index )
+        return self.__open_task_index
+
+    def merge( self, number, text ):
+        """
+        Merge a duplicate task into the task on line number. Only the 
+        priority is carried over, the rest is the same task.
+        """
+        task = self.task( number )
+
+        res = priority_re.match( date_prefix_re.sub( "", text.strip() ) )
+        if res and not task.done:
+            task.text = " ".join( [ 
+                res.group( 0 ), remove_priority( task.text ) 
+                ] )
+            self.__lines[ number - 1 ] = task.text
+
+        return task
+
+    def prioritise( self, number, priority ):
+        """
+        Set the priority of a task.
+        If it already has a piority setting replace it.
+        """
+
+        if not re.match( "^[A-Z]$", priority ):
+            raise TodoError( "PRIORITY must be A to Z, not \"%s\"" % priority )
+    
+        task = self.task( number )
+
+        # Check the task hasn't already been done.
+        if task.done:
+            raise TodoError( "Task is completed", task )
+
+        # If the task already has a prority, replace it
+        task.text = " ".join( [ 
+            "(%s)" % priority, remove_priority( task.text ) ] )
+
+        self.__lines[ number - 1 ] = task.text
+        return task
+
+    def query( self, terms=None ):
+        """
+        Return the tasks that contain all terms, sorted alphabetically.
+        Each task keeps its line number.
+        """
+        tasks = self.tasks()
+
+        # Sort list alphabetically, ignoring line number
+        tasks.sort( key=lambda task: task.text )
+
+        if terms:
+            terms_regex = re.compile( build_term_filter( terms ) )
+            debug( terms_regex.pattern )
+
+            # Terms must follow a non-word character, even at the start
+            tasks = [ task for task in tasks 
+                    if terms_regex.search( " " + task.text ) ]
+
+        return tasks
+
+    def stats( self ):
+        "Count the tasks in the list, returned as a dictionary"
+        tasks = self.tasks()
+        return {
+                "tasks":        len( tasks ),
+                "done":         len( [ task for task in tasks if task.done ] ),
+                "prioritised":  len( [ task for task in tasks if task.priority ] )
+                }
+
+    def history( self ):
+        "Return an up to date DoneSnapshot of the done file"
+        return DoneSnapshot.load( self.done_file )
+
+    def generations( self ):
+        "Return the names of the backup generations of this list, newest first"
+        return self.backups.names( [ self.todo_file, self.done_file ] )
+
+    def restore( self, generation ):
+        """
+        Roll the todo and done files back to how they were before the
+        backup generation was made, and reload the list. Unlike the other
+        actions this writes the files straight away. What the restore
+        removes is backed up as a new generation, so it can be undone.
+        """
+        if generation not in self.backups.names():
+            raise TodoError( "No backup generation \"%s\"." % generation )
+
+        undo = None
+        if self.backups.generations:
+            undo = self.backups.create()
+
+        self.backups.restore( 
+                generation, [ self.todo_file, self.done_file ], undo )
+        self.backups.prune( [ self.todo_file, self.done_file ] )
+
+        self.__archived = []
+        self.__read()
+
+    def save( self ):
+        """
+        Write the todo file and append any archived tasks to the done file.
+        The tasks are sorted before the file is written.
+        """
+
+        backup = None
+        if self.backups.generations:
+            backup = self.backups.create()
+
+        if self.__archived:
+            # Also determines wethe the file mode is 'append' or 'write'.
+            if backup:
+                self.backups.record_append( backup, self.done_file )
+
+            if os.path.exists( self.done_file ):
+                mode = "a"
+            else:
+                mode = "w"
+
+            with open( self.done_file, mode ) as fh:
+                for task in self.__archived:
+                    fh.write( "%s\n" % task )
+                fh.close()
+
+            self.__archived = []
+
+            # Add the archived tasks to the snapshot, once there is one.
+            if os.path.exists( DoneSnapshot( self.done_file ).snapshot_file ):
+                self.history()
+
+        # The todo file is replaced, never rewritten, so that the backup can
+        # be a link to the original file.
+        if backup:
+            self.backups.snapshot( backup, self.todo_file )
+            self.backups.prune( [ self.todo_file, self.done_file ] )
+
+        self.__lines.sort()
+        self.__open_task_index = None
+
+        with open( self.todo_file + ".tmp", "w" ) as fh:
+            for line in self.__lines:
+                fh.write( "%s\n" % line )
+            fh.close()
+
+        replace_file( self.todo_file + ".tmp", self.todo_file )
+
+        if self.__sync_base:
+            ( base_file, lines ) = self.__sync_base
+            with open( base_file, "w" ) as fh:
+                for ( key, line ) in lines:
+                    fh.write( "%s %s\n" % ( 
+                        key, task_hash( line ).encode( "hex" ) ) )
+                fh.close()
+
+            self.__sync_base = None
+
+    def sync( self, remote ):
+        """
+        Three-way merge of this list with remote, the same list in another
+        todo directory, against the lines both had after the last sync.
+        Lines are compared by hash in a single pass over each list; a line
+        is kept unless one side has deleted or changed it since the last
+        sync. Identical lines are merged into one.
+
+        If both sides changed the same task, a done task wins over an open
+        one, otherwise the list whose file was written last wins. Each done
+        file gets the archived tasks it is missing.
+
+        Both lists are only changed in memory, save() them to write the
+        merge. The base for the next sync is recorded by this list's save().
+        Returns a dictionary counting the changes and listing the conflicts.
+        """
+        # The base holds the line and task hashes of each line at the last
+        # sync, so both exact lines and tasks that existed can be found.
+        base_file = self.sync_base_file( remote )
+        base = set()
+        base_tasks = set()
+        if os.path.exists( base_file ):
+            with open( base_file ) as fh:
+                for line in fh:
+                    hashes = line.split()
+                    if hashes:
+                        base.add( hashes[0] )
+                        base_tasks.update( hashes[1:] )
+                fh.close()
+
+        local = dict( [ ( line_hash( line ), line )
+            for line in self.__lines if line ] )
+        theirs = dict( [ ( line_hash( line ), line )
+            for line in remote.__lines if line ] )
+
+        remote_newer = file_mtime( remote.todo_file ) > \
+                file_mtime( self.todo_file )
+
+        # Lines only added remotely, by task so that changes to the same
+        # task on both sides can be found.
+        remote_added = {}
+        for ( key, line ) in theirs.items():
+            if key not in base and key not in local:
+                remote_added.setdefault( task_hash( line ), [] ).append( line )
+
+        merged = {}
+        conflicts = []
+        for ( key, line ) in local.items():
+            if key in theirs:
+                merged[ key ] = line
+            elif key not in base:
+                # Added or changed locally, check it wasn't changed remotely
+                other = remote_added.get( task_hash( line ) )
+                if other:
+                    line = resolve_conflict( line, other.pop(), remote_newer )
+                    conflicts.append( self.__task( line ) )
+                merged[ line_hash( line ) ] = line
+
+        for lines in remote_added.values():
+            for line in lines:
+                merged[ line_hash( line ) ] = line
+
+        # Done files are only appended to, so send each the lines it lacks.
+        local_done = [ task.text for task in self.done_tasks() if task.text ]
+        remote_done = [ task.text for task in remote.done_tasks() if task.text ]
+
+        local_keys = set( [ line_hash( line ) for line in local_done ] )
+        remote_keys = set( [ line_hash( line ) for line in remote_done ] )
+
+        pulled = [ line for line in remote_done
+                if line_hash( line ) not in local_keys ]
+        pushed = [ line for line in local_done
+                if line_hash( line ) not in remote_keys ]
+
+        # A task that existed at the last sync and has since been archived
+        # on one side is done, so it wins over changes made to it on the
+        # other side. New tasks, and tasks added again on the side that
+        # archived them, are always kept.
+        pulled_tasks = dict( [ ( task_hash( line ), line ) for line in pulled ] )
+        pushed_tasks = dict( [ ( task_hash( line ), line ) for line in pushed ] )
+        for ( key, line ) in merged.items():
+            if key in base or done_re.match( line ):
+                continue
+
+            task = task_hash( line )
+            if task.encode( "hex" ) not in base_tasks:
+                continue
+
+            done = None
+            if key in local and key not in theirs:
+                done = pulled_tasks.get( task )
+            elif key in theirs and key not in local:
+                done = pushed_tasks.get( task )
+
+            if done:
+                del merged[ key ]
+                conflicts.append( self.__task( done, filename=self.done_file ) )
+
+        changes = {
+                "local_added":    len( set( merged ) - set( local ) ),
+                "local_removed":  len( set( local ) - set( merged ) ),
+                "remote_added":   len( set( merged ) - set( theirs ) ),
+                "remote_removed": len( set( theirs ) - set( merged ) ),
+                "done_pulled":    len( pulled ),
+                "done_pushed":    len( pushed ),
+                "conflicts":      conflicts
+                }
+
+        self.__lines = merged.values()
+        remote.__lines = merged.values()
+        self.__open_task_index = None
+        remote.__open_task_index = None
+        self.__sync_base = ( base_file, merged.items() )
+
+        self.__archived.extend( pulled )
+        remote.__archived.extend( pushed )
+
+        return changes
+
+    def sync_base_file( self, remote ):
+        "The file recording the line hashes of the last sync with remote"
+        remote_dir = os.path.abspath( remote.todo_dir )
+        return os.path.join( self.todo_dir, "%s-%s.sync" % (
+            self.name, line_hash( remote_dir )[:12] )
+            )
+
+
+class TodoLists( object ):
+    """
+    All the lists in a todo directory. Each list is loaded and queried in
+    its own thread and the results are merged, numbering the tasks across 
+    the lists in list order.
+    """
+
+    def __init__( self, todo_lists ):
+        self.lists = todo_lists
+
+    @classmethod
+    def load( cls, todo_dir, names=None ):
+        "Load the named lists, or every list in todo_dir"
+        if names is None:
+            names = list_names( todo_dir )
+
+        return cls( parallel_map( 
+            lambda name: TodoList.load( todo_dir, name ), names ) 
+            )
+
+    def __len__( self ):
+        return sum( [ len( todo_list ) for todo_list in self.lists ] )
+
+    def query( self, terms=None ):
+        """
+        Return ( number, task ) pairs for the tasks in every list that
+        contain all terms, sorted alphabetically. The number counts across
+        the lists, the task keeps its line number in its own list.
+        """
+        results = parallel_map(
+                lambda todo_list: todo_list.query( terms ), self.lists )
+
+        # Each list's results are already sorted, so only merge them
+        offset = 0
+        sorted_results = []
+        for ( todo_list, tasks ) in zip( self.lists, results ):
+            sorted_results.append( [ 
+                ( task.text, offset + task.number, task ) for task in tasks 
+                ] )
+            offset += len( todo_list )
+
+        return [ ( number, task ) 
+                for ( text, number, task ) in merge( *sorted_results ) ]
+
+    def stats( self ):
+        "Return ( list name, stats ) pairs for every list"
+        results = parallel_map(
+                lambda todo_list: todo_list.stats(), self.lists )
+
+        return zip( [ todo_list.name for todo_list in self.lists ], results )
+
+
+###############################################################################
+#
+# todo Class
+#
+###############################################################################
+
+class todo( object ):
+    "Command line interface to a TodoList"
+
+    # Actions that can read every list at once with "--list all"
+    cross_list_actions = [ "help", "list", "ls", "shorthelp", "stats" ]
+
+    def __init__( self, todo_dir, **kwargs ):
+        "Load the todo list, or every list if the list is 'all'"
         self.__kwargs = kwargs
+        self.__todo = None
+        self.__lists = None
+
+        list_name = kwargs.get( "list" ) or "todo"
+        try:
+            if list_name == "all":
+                self.__lists = TodoLists.load( todo_dir )
+            else:
+                self.__todo = TodoList.load(
+                        todo_dir, list_name, kwargs.get( "backups", 10 ) )
+        except TodoError as err:
+            todo_error( err )
 
         self.__dispatcher = {
                 "a":            self.__add,
                 "add":          self.__add,
+                "analyze":      self.__analyze,
                 "archive":      self.__archive,
+                "dedupe":       self.__dedupe,
                 "del":          self.__delete,
                 "depri":        self.__deprioritise,
                 "do":           self.__do,
@@ -358,8 +1701,11 @@ class todo( object ):
                 "list":         self.__list,
                 "pri":          self.__priority,
                 "p":            self.__priority,
+                "restore":      self.__restore,
                 "rm":           self.__delete,
-                "shorthelp":    self.__shorthelp
+                "shorthelp":    self.__shorthelp,
+                "stats":        self.__stats,
+                "sync":         self.__sync
                 }
 
     def command( self, action ):
@@ -370,68 +1716,121 @@ class todo( object ):
             error( "Empty action list passed!" )
 
         cmd = self.__dispatcher.get( action[0] )
-        if cmd:
-            return cmd( action[1:] ) 
-        else:
+        if not cmd:
             todo_error( "Unknown action: %s" % action[0] )
 
+        if self.__lists is not None and \
+                action[0] not in self.cross_list_actions:
+            todo_error( "Select a list for \"%s\" with --list NAME" % action[0] )
+
+        try:
+            return cmd( action[1:] ) 
+        except TodoError as err:
+            if err.task:
+                todo_error( "%s\n\t%s" % ( err, self.__colour_task( err.task ) ) )
+            todo_error( err )
+
     def __add(self, args):
         "Add a new task to the list"
-        
-        # prepend the date to the start of the task
-        args.insert( 0, "%s" % date.today().strftime("%Y-%m-%d") )
 
         # Join everything together - this works if the task was in
         # quotes or was a list of words as args
-        task = " ".join( args )
+        text = " ".join( args )
 
-        self.__lines.append( task )
-    
-        self.__write_todo()
+        duplicates = self.__kwargs.get( "duplicates", "reject" )
+        force = self.__kwargs.get( "force" ) or duplicates == "allow"
 
-        print_todo( "Added new task\n\t%s" % self.__colour( task)  )
+        try:
+            task = self.__todo.add( text, force )
+            message = "Added new task"
+        except DuplicateTaskError as err:
+            if duplicates != "merge":
+                err.args = ( "%s, use --force to add anyway" % err, )
+                raise
+            task = self.__todo.merge( err.task.number, text )
+            message = "Merged with task %d" % task.number
+
+        self.__todo.save()
+
+        print_todo( "%s\n\t%s" % ( message, self.__colour( task.text ) ) )
         print "--"
         self.__list()
 
-    def __archive(self, args):
-        "Takes all completed tasks and archives them in the 'done.txt' file"
-
-        completed = []
-        for task in self.__lines:
-            if done_re.match( task ):
-                completed.append(task)
+    def __analyze(self, args):
+        "Analyse the tasks in the done file"
+
+        # Validate the arguments, a period can only follow a group
+        periods = ( "week", "month" )
+        if len(args) > 2 or ( len(args) == 2 and 
+                ( args[0] in periods or args[1] not in periods ) ):
+            todo_error( "\"analyze\" action takes "
+                    "[project|context|priority] [week|month] arguments." )
+
+        history = self.__todo.history()
+
+        if not args:
+            return self.__analyze_summary( history )
+
+        if args[0] in ( "week", "month" ):
+            print "--\nTODO:\tTasks completed each %s:" % args[0]
+            for ( start, count ) in history.completions( args[0] ):
+                print "\t%s %6d" % ( start, count )
+            print "--"
+            return
+
+        period = None
+        if len(args) > 1:
+            period = args[1]
+        counts = history.counts( args[0], period )
+
+        if period:
+            # By period, then by most tasks
+            keys = sorted( counts,
+                    key=lambda key: ( key[1], -counts[ key ], key[0] ) )
+            print "--\nTODO:\tTasks completed each %s by %s:" % (
+                    period, args[0] )
+            for key in keys:
+                print "\t%s %6d  %s" % ( key[1], counts[ key ], key[0] )
+        else:
+            keys = sorted( counts, key=lambda key: ( -counts[ key ], key[0] ) )
+            print "--\nTODO:\tTasks completed by %s:" % args[0]
+            for key in keys:
+                print "\t%6d  %s" % ( counts[ key ], key[0] )
+        print "--"
 
-        # Can't archive if not tasks are completed
-        if not completed:
-            todo_error("No tasks marked done.")
+    def __analyze_summary(self, history):
+        "Display the number of tasks done, throughput and lead time"
+        if not len( history ):
+            todo_error( "No completed tasks in %s." %
+                    os.path.basename( history.done_file ) )
 
-        # just in case.
-        completed.sort()
+        weeks = history.completions( "week" )
+        months = history.completions( "month" )
+        lead_times = history.lead_times()
 
-        # Now remove completed tasks from the main task list
-        for task in completed:
-            self.__lines.remove( task )
-
-        # Back up the original file before writing a new one, if it exists.
-        # Also determines wethe the file mode is 'append' or 'write'.
-        if os.path.exists( self.done_file ):
-            (path_name, ext) = os.path.splitext( self.done_file )
-            backup_filename = ".".join( [ path_name, "bak"] )
-            shutil.copyfile( self.done_file, backup_filename )
-            mode = "a"
-        else:
-            mode = "w"
+        print_todo( "Completed %d tasks, %s to %s" % (
+            len( history ),
+            date.fromordinal( min( history.completed ) ),
+            date.fromordinal( max( history.completed ) ) )
+            )
+        print "\tThroughput: %.1f tasks a week, %.1f a month" % (
+                float( len( history ) ) / len( weeks ),
+                float( len( history ) ) / len( months ) )
+        print "\tLead time:  mean %.1f days, median %s, max %d " \
+                "(%d tasks with a creation date)" % (
+                lead_times[ "mean" ], lead_times[ "median" ],
+                lead_times[ "max" ], lead_times[ "tasks" ] )
+        print "--"
 
-        with open( self.done_file, mode ) as fh:
-            for task in completed:
-                fh.write( "%s\n" % task )
-            fh.close()
+    def __archive(self, args):
+        "Takes all completed tasks and archives them in the 'done.txt' file"
 
-        self.__write_todo()
+        completed = self.__todo.archive()
+        self.__todo.save()
 
         print_todo("The following tasks have been archived:")
         for task in completed:
-            print "\t%s" % self.__colour( task )
+            print "\t%s" % self.__colour( task.text )
         print "--"
         self.__list()
 
@@ -478,21 +1877,35 @@ class todo( object ):
 
         return text
 
+    def __colour_task( self, task ):
+        "Colour a task, prefixed with its line number"
+        return self.__colour( "%-3d %s" % ( task.number, task.text ) )
+
+    def __dedupe(self, args):
+        "List clusters of duplicate tasks in todo.txt and optionally done.txt"
+
+        duplicates = self.__todo.duplicates( include_done="done" in args )
+
+        for cluster in duplicates:
+            print "--"
+            for task in cluster:
+                label = ""
+                if task.source != os.path.basename( self.__todo.todo_file ):
+                    label = "%s:" % task.source
+                print "\t%s%s" % ( label, self.__colour_task( task ) )
+
+        print_todo( "%d clusters of duplicate tasks" % len( duplicates ) )
+
     def __delete(self, args):
         "Delete task(s) from the to do list"
         items = self.__items_from_args( args )
 
         print "--\nTODO:",
     
-        # reverse sort the items so that tasks are deleted from the 
-        # bottom up and avoid an IndexError.
-        items.reverse()
-
-        for item in items:
-            task = self.__lines.pop( item )
-            print "\tDeleted task: %s" % self.__colour( task )
+        for task in self.__todo.delete( items ):
+            print "\tDeleted task: %s" % self.__colour( task.text )
 
-        self.__write_todo()
+        self.__todo.save()
         print "--"
         self.__list()
 
@@ -503,29 +1916,13 @@ class todo( object ):
         print "--\nTODO:",
 
         for item in items:
-            task = self.__lines[ item ]
-
-            # Check the task hasn't already been completed
-            if done_re.match( task ):
-                print"\tERROR: Task completed: %s" % self.__colour( task )
-                continue
-
-            res = priority_re.match( task )
-            if res:
-                task = priority_re.sub( "", task )
-                
-                # Get rid of extra whitespace too.
-                task = task.strip()
+            try:
+                task = self.__todo.deprioritise( item )
+                print "\tDeprioritised: %s" % self.__colour( task.text )
+            except TodoError as err:
+                print "\tERROR: %s: %s" % ( err, self.__colour( err.task.text ) )
 
-                print "\tDeprioritised: %s" % self.__colour( task )
-
-            else:
-                print "\tERROR: No priority: %s" % self.__colour( task )
-                continue
-
-            self.__lines[ item ] = task
-
-        self.__write_todo()
+        self.__todo.save()
         print "--"
         self.__list()
 
@@ -537,19 +1934,10 @@ class todo( object ):
         print "--\nTODO:",
 
         for item in items:
-            task = self.__lines[ item ]
-
-            # Check the task hasn't already been marked done.
-            if not done_re.match( task ):
-                self.__lines[ item ] = " ".join( [
-                    "x",
-                    date.today().strftime("%Y-%m-%d"),
-                    task
-                    ] )
+            task = self.__todo.complete( item )
+            print "\tMarked done: %s" % self.__colour( task.text )
 
-            print "\tMarked done: %s" % self.__colour( task )
-
-        self.__write_todo()
+        self.__todo.save()
         print "--"
         self.__list()
 
@@ -562,8 +1950,9 @@ class todo( object ):
         # Convert args to integers 
         items = [ str_to_int( arg ) for arg in args ]
 
-        # Range check items (decrements by 1 at thes same time)
-        items = [ self.__range_check( item ) for item in items ]
+        # Range check items
+        for item in items:
+            self.__todo.task( item )
 
         return items
 
@@ -571,24 +1960,28 @@ class todo( object ):
         """List tasks
         NEVER changes or writes the the todo file.
         """
-        self.__lines = add_line_numbers( self.__lines )
+        if self.__lists is not None:
+            return self.__list_all( args )
 
-        # Sort list alphabetically, ignoring line number
-        self.__lines.sort( key=remove_line_no )
+        tasks = self.__todo.query( args )
 
-        if args:
-            terms_regex = build_term_filter( args )
-            debug( terms_regex )
-            self.__lines = [
-                    line for line in self.__lines if \
-                    re.search( terms_regex, line) 
-                    ]
+        for task in tasks:
+            print self.__colour_task( task )
 
-        for line in self.__lines:
-            print self.__colour( line )
+        print_todo ("%s of %s tasks" % ( len( tasks ), len( self.__todo ) ) )
+
+    def __list_all(self, args):
+        "List tasks from every list, numbered across the lists"
+        tasks = self.__lists.query( args )
+
+        for ( number, task ) in tasks:
+            print "%s [%s:%d]" % ( 
+                    self.__colour( "%-3d %s" % ( number, task.text ) ),
+                    task.list_name, task.number
+                    )
 
-        print_todo ("%s of %s tasks" % ( 
-            len( self.__lines ), self.__list_size )
+        print_todo ("%s of %s tasks in %d lists" % ( 
+            len( tasks ), len( self.__lists ), len( self.__lists.lists ) )
             )
  
     def __help(self, args):
@@ -607,66 +2000,97 @@ class todo( object ):
             todo_error( 
                     "\"pri\" action requires ITEM# and PRIORITY arguments." 
                     )
-        # First arg is the ITEM#
-        item = str_to_int( args[0] )
-        item = self.__range_check( item )
 
-        priority = args[1]
-        # Second arg is the priority
-        if not re.match( "^[A-Z]$", priority ):
-            todo_error( "PRIORITY must be A to Z, not \"%s\"" % priority )
-    
-        task = self.__lines[ item ]
+        # First arg is the ITEM#, second arg is the priority
+        task = self.__todo.prioritise( str_to_int( args[0] ), args[1] )
+        self.__todo.save()
 
-        # Check the task hasn't already been done.
-        if done_re.match( task ):
-            todo_error( 
-                    "Task is completed\n\t%s" % self.__colour( task )
-                    )
+        print_todo( "Task priority set.\n\t%s" % self.__colour( task.text ) )
+        print "--"
+        self.__list()
 
-        # If the task already has a prority, change it
-        res = priority_re.match( task )
-        if res:
-            task = priority_re.sub( "(%s)" % priority, task )
-        else:
-            task = " ".join( [ "(%s)" % priority, task ] )
+    def __restore(self, args):
+        "List the backup generations, or roll back to one of them"
+        generations = self.__todo.generations()
 
-        self.__lines[ item ] = task
-        self.__write_todo()
+        if not args:
+            print "--\nTODO:\tBackup generations, newest first:"
+            for ( number, name ) in enumerate( generations, 1 ):
+                taken = self.__todo.backups.taken( name )
+                files = self.__todo.backups.files(
+                        name, [ self.__todo.todo_file, self.__todo.done_file ] )
+                print "\t%-3d %s  %s" % ( number, taken,
+                        " ".join( [ os.path.basename( filename )
+                            for filename in files ] ) )
+            print_todo( "%d backup generations" % len( generations ) )
+            return
 
-        print_todo( "Task priority set.\n\t%s" % self.__colour( task ) )
-        print "--"
-        self.__list()
+        if len(args) != 1:
+            todo_error( "\"restore\" action takes one GENERATION# argument." )
 
-    def __range_check( self, item ):
-        "Check that this item is within the task list range"
+        number = str_to_int( args[0] )
+        if number < 1 or number > len( generations ):
+            todo_error( "%d is outside backup generation range." % number )
 
-        if item < 1 or item > self.__list_size:
-            todo_error( "%d is outside todo list range." % item )
+        self.__todo.restore( generations[ number - 1 ] )
 
-        # Decrement item so that it can be used as an index to self.__lines.
-        return item - 1
+        print_todo( "Restored to before backup generation %d" % number )
+        print "--"
+        self.__list()
 
     def __shorthelp(self, args):
         "Display short help"
         print shorthelp_doc
 
-    def __write_todo(self):
-        "Writes the todo file. The tasks are sorted before the file is written"
-
-        # Back up the original file before writing a new one, if it exists
-        if os.path.exists( self.todo_file ):
-            (path_name, ext) = os.path.splitext( self.todo_file )
-            backup_filename = ".".join( [ path_name, "bak"] )
-            shutil.copyfile( self.todo_file, backup_filename )
-
-        self.__lines.sort()
-
-        with open( self.todo_file, "w" ) as fh:
-            for line in self.__lines:
-                fh.write( "%s\n" % line )
-            fh.close() 
+    def __stats(self, args):
+        "Display task counts for the list, or for every list"
+        if self.__lists is not None:
+            stats = self.__lists.stats()
+        else:
+            stats = [ ( self.__todo.name, self.__todo.stats() ) ]
+
+        columns = [ "tasks", "done", "prioritised" ]
+        if len( stats ) > 1:
+            totals = dict( [ ( column, sum( [ counts[ column ] 
+                for ( name, counts ) in stats ] ) ) for column in columns ] )
+            stats.append( ( "total", totals ) )
+
+        print "--\nTODO:\t%-15s %8s %8s %12s" % tuple( [ "list" ] + columns )
+        for ( name, counts ) in stats:
+            print "\t%-15s %8d %8d %12d" % tuple(
+                    [ name ] + [ counts[ column ] for column in columns ] )
+        print "--"
 
+    def __sync(self, args):
+        "Merge the todo list with the same list in another todo directory"
+
+        if len(args) != 1:
+            todo_error( "\"sync\" action requires a DIRECTORY argument." )
+
+        if not os.path.isdir( args[0] ):
+            todo_error( "%s does not exist" % args[0] )
+
+        remote = TodoList.load(
+                args[0], self.__todo.name, self.__kwargs.get( "backups", 10 ) )
+        changes = self.__todo.sync( remote )
+
+        # Only rewrite the other copy if it needs any of the changes
+        if changes[ "remote_added" ] or changes[ "remote_removed" ] or \
+                changes[ "done_pushed" ]:
+            remote.save()
+        self.__todo.save()
+
+        print_todo( "Synchronised with %s" % args[0] )
+        print "\tHere:  %d added, %d removed, %d archived" % (
+                changes[ "local_added" ], changes[ "local_removed" ],
+                changes[ "done_pulled" ] )
+        print "\tThere: %d added, %d removed, %d archived" % (
+                changes[ "remote_added" ], changes[ "remote_removed" ],
+                changes[ "done_pushed" ] )
+        for task in changes[ "conflicts" ]:
+            print "\tConflict resolved: %s" % self.__colour( task.text )
+        print "--"
+        self.__list()
 
 ###############################################################################
 #
@@ -701,6 +2125,16 @@ if __name__ == "__main__":
             help = 'plain mode. Cannot be used with -c --colour.'
             )
 
+    parser.add_argument(
+            '-f', '--force', action = 'store_true',
+            help = 'Add the task even if it duplicates an open task.'
+            )
+
+    parser.add_argument(
+            '-l', '--list', metavar = 'NAME',
+            help = 'List to use, default "todo". "all" lists every list.'
+            )
+
     parser.add_argument(
             '-v', '--verbose', action = 'store_true', 
             help = 'Output extra debug information.' 
@@ -711,7 +2145,13 @@ if __name__ == "__main__":
             help = 'Action to be performed, use "help" action for list'
             )
 
-    args = parser.parse_args()
+    # Options may follow the action, e.g. "add --force TASK", so the words
+    # argparse could not place are added back on to the action.
+    args, extra_args = parser.parse_known_args()
+    for arg in extra_args:
+        if arg.startswith( "-" ):
+            parser.error( "unrecognized arguments: %s" % arg )
+    args.action.extend( extra_args )
 
     if args.verbose:
         logging.getLogger().setLevel( logging.DEBUG ) 
@@ -762,7 +2202,11 @@ if __name__ == "__main__":
     # Load the todo list into an object
     td = todo( 
             cfg["todo_dir"], 
-            colour = use_colour
+            colour = use_colour,
+            list = args.list,
+            backups = int( cfg.get( "backup_generations", 10 ) ),
+            force = args.force,
+            duplicates = cfg.get( "duplicate_tasks", "reject" ).lower()
             )
 
     # arg is always chosen over cfg but if arg.action is None, then 